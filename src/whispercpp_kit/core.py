@@ -1,13 +1,31 @@
+import functools
+import json
 import logging
 import os
 import platform
+import queue
 import shutil
+import signal
+import stat
+import socket
 import subprocess
 import tempfile
+import threading
+import time
 from pathlib import Path
 import hashlib
-import ffmpeg
-from typing import Optional, Union
+from typing import (
+    IO,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 from dataclasses import dataclass
 
 
@@ -24,11 +42,197 @@ class WhisperState:
     is_model_ready: bool = False
 
 
+HASH_CHUNK_SIZE = 1 << 20
+
+logger = logging.getLogger(__name__)
+
+
+def _ffmpeg_cmd(
+    src: str, dst: str, sr: int, threads: Optional[int] = None
+) -> List[str]:
+    """Build the ffmpeg argv converting src to mono 16-bit PCM wav at dst.
+
+    Pass "-" as dst to write the wav to stdout.
+    """
+    cmd = ["ffmpeg", "-nostdin", "-loglevel", "error"]
+    if threads is not None:
+        cmd.extend(["-threads", str(threads)])
+    cmd.extend(["-i", src, "-ar", str(sr), "-ac", "1", "-acodec", "pcm_s16le"])
+    # Format is explicit since dst may be stdout or a temp name without .wav
+    cmd.extend(["-f", "wav", "-y", dst])
+    return cmd
+
+
+def _tmp_path(path: Path) -> Path:
+    """Sibling temp path unique to this process and thread"""
+    return path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+
+def _sweep_tmp_files(cache_dir: Path) -> None:
+    """Remove temp files left in cache_dir by processes that no longer exist.
+
+    Only names produced by _tmp_path (``<name>.<pid>.<thread id>.tmp``) are
+    considered, so unrelated files in a user-supplied cache dir are left alone.
+    """
+    for tmp in cache_dir.glob("*.*.*.tmp"):
+        parts = tmp.name.split(".")
+        if not (parts[-3].isdigit() and parts[-2].isdigit()):
+            continue
+        try:
+            os.kill(int(parts[-3]), 0)
+        except ProcessLookupError:
+            tmp.unlink(missing_ok=True)
+        except PermissionError:
+            pass  # Owned by another user's live process
+
+
+def _fast_copy(src: Path, dst: Path) -> None:
+    """Copy src to dst in the kernel with sendfile where the OS supports it"""
+    if not hasattr(os, "sendfile") or platform.system() != "Linux":
+        shutil.copyfile(src, dst)
+        return
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        sfd, dfd = fsrc.fileno(), fdst.fileno()
+        while os.sendfile(dfd, sfd, None, 1 << 24):
+            pass
+
+
+def _pin(process: subprocess.Popen, affinity: Optional[Set[int]]) -> None:
+    """Restrict a freshly started process to the given CPUs, if any"""
+    if affinity:
+        try:
+            os.sched_setaffinity(process.pid, affinity)
+        except OSError:
+            pass  # Already exited, or not permitted
+
+
+def _index_entry(input_path: Path, cache_dir: Path) -> Path:
+    """Index file recording the content hash of one input path.
+
+    The index is sharded into one small file per path, so lookups and updates
+    touch a single entry and a changed input overwrites its own stale entry.
+    """
+    key = hashlib.blake2b(str(input_path).encode(), digest_size=16).hexdigest()
+    return cache_dir / "index" / key
+
+
+def _content_hash(input_path: Path, cache_dir: Path) -> str:
+    """Hash file contents, reusing the cached digest when stat is unchanged"""
+    st = input_path.stat()
+    stat_key = f"{st.st_size}-{st.st_mtime_ns}"
+    entry_path = _index_entry(input_path, cache_dir)
+
+    try:
+        entry_stat, content_hash = entry_path.read_text().split()
+        if entry_stat == stat_key:
+            return content_hash
+    except (OSError, ValueError):
+        pass
+
+    h = hashlib.blake2b(digest_size=16)
+    mv = memoryview(bytearray(HASH_CHUNK_SIZE))
+    with open(input_path, "rb") as f:
+        while True:
+            n = f.readinto(mv)
+            if not n:
+                break
+            h.update(mv[:n])
+    content_hash = h.hexdigest()
+
+    tmp_entry = _tmp_path(entry_path)
+    try:
+        entry_path.parent.mkdir(exist_ok=True)
+        tmp_entry.write_text(f"{stat_key} {content_hash}")
+        os.replace(tmp_entry, entry_path)
+    except OSError as e:
+        tmp_entry.unlink(missing_ok=True)
+        logger.debug(f"Could not update cache index: {e}")
+    return content_hash
+
+
+def _prune_index(cache_dir: Path) -> None:
+    """Drop index entries whose converted wav is no longer in the cache"""
+    for entry in (cache_dir / "index").glob("*"):
+        if entry.name.endswith(".tmp"):
+            continue
+        try:
+            content_hash = entry.read_text().split()[1]
+        except (OSError, IndexError):
+            content_hash = None
+        if content_hash is None or not (cache_dir / f"{content_hash}.wav").exists():
+            entry.unlink(missing_ok=True)
+
+
+@functools.lru_cache(maxsize=256)
+def _resolve_or_convert(
+    abs_path: str,
+    sr: int,
+    cache_dir: str,
+    size: int,
+    mtime_ns: int,
+    threads: Optional[int] = None,
+) -> str:
+    """Return the converted wav for abs_path, converting on cache miss.
+
+    size and mtime_ns are part of the memo key so edited inputs are re-resolved.
+    """
+    input_path = Path(abs_path)
+    try:
+        cache_key = _content_hash(input_path, Path(cache_dir))
+    except OSError as e:
+        raise WhisperCPPError(f"Cannot read audio file: {e}")
+    cache_path = Path(cache_dir) / f"{cache_key}.wav"
+
+    if cache_path.exists():
+        logger.debug("Using cached converted audio")
+        return str(cache_path)
+
+    logger.debug("Converting audio...")
+    _convert(abs_path, str(cache_path), sr, threads)
+    return str(cache_path)
+
+
+def _convert(src: str, dst: str, sr: int, threads: Optional[int] = None) -> None:
+    """Run ffmpeg to convert src into dst.
+
+    ffmpeg writes to a temp file that is renamed over dst only on success, so
+    an interrupted conversion never leaves a truncated wav in the cache.
+    """
+    tmp_path = _tmp_path(Path(dst))
+    try:
+        subprocess.run(
+            _ffmpeg_cmd(src, str(tmp_path), sr, threads),
+            check=True,
+            capture_output=True,
+        )
+        os.replace(tmp_path, dst)
+    except subprocess.CalledProcessError as e:
+        raise WhisperCPPError(f"Audio conversion failed: {e.stderr.decode()}")
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
 class WhisperCPP:
     SAMPLE_RATE = 16000
     DEFAULT_CACHE_DIR = Path(tempfile.gettempdir()) / "whisper-cpp-cache"
     DEFAULT_LIB_DIR = Path.home() / ".whisper.cpp"
     DEFAULT_THREADS = os.cpu_count() or 1
+    # Beyond these thread counts whisper.cpp stops scaling for the model size
+    MODEL_THREAD_CAPS = {"tiny": 4, "base": 4, "small": 6, "medium": 8, "large": 8}
+    WHISPER_CPP_VERSION = "v1.7.6"
+    MODEL_URL = "https://huggingface.co/ggerganov/whisper.cpp/resolve/main"
+    TDRZ_MODEL_URL = (
+        "https://huggingface.co/akashmjn/tinydiarize-whisper.cpp/resolve/main"
+    )
+    HOT_MODEL_DIR = Path("/dev/shm") / f"whispercpp-kit-{os.getuid()}"
+    DOWNLOAD_CHUNK_SIZE = 64 << 20
+    DOWNLOAD_WORKERS = 8
+    DEVICE_CMAKE_ARGS = {
+        "cpu": [],
+        "cuda": ["-DGGML_CUDA=ON"],
+        "metal": ["-DGGML_METAL=ON", "-DGGML_METAL_EMBED_LIBRARY=ON"],
+    }
 
     def __init__(
         self,
@@ -40,6 +244,14 @@ class WhisperCPP:
         skip_checks: bool = False,
         num_threads: Optional[int] = None,
         verbose: bool = False,
+        build_flags: Optional[List[str]] = None,
+        device: Literal["cpu", "cuda", "metal", "auto"] = "auto",
+        model_cache_size: Optional[int] = None,
+        persistent: bool = False,
+        keep_hot: bool = False,
+        quantization: Literal["fp16", "q5_0", "q4_0", "q8_0"] = "fp16",
+        flash_attn: bool = True,
+        gpu_device: Optional[int] = None,
     ):
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(log_level)
@@ -54,32 +266,120 @@ class WhisperCPP:
 
         self.base_path = Path(lib_dir) if lib_dir else self.DEFAULT_LIB_DIR
         self.cache_dir = Path(cache_dir) if cache_dir else self.DEFAULT_CACHE_DIR
+        if quantization not in ("fp16", "q5_0", "q4_0", "q8_0"):
+            raise WhisperCPPError(f"Unsupported quantization: {quantization}")
+        self.quantization = quantization
         self.model_path = Path(model_path) if model_path else None
+        self.source_model_path = self.model_path
+        if self.model_path is not None and quantization != "fp16":
+            self.model_path = self._quantized_path(self.model_path)
         self.model_name = model_name
+        self.custom_model = model_path is not None
+        self.model_cache_size = model_cache_size
+        self.keep_hot = keep_hot
+        # On-disk model backing a keep_hot copy in tmpfs
+        self.disk_model_path = None
         self.state = WhisperState()
 
         self.system = platform.system().lower()
+        self.build_flags = build_flags
+        if device not in ("cpu", "cuda", "metal", "auto"):
+            raise WhisperCPPError(f"Unsupported device: {device}")
+        self.device = device
+        self._auto_device = device == "auto"
         self._setup_platform_configs()
+        # Command-line strings are precomputed to keep transcribe() cheap
+        self._binary_str = str(
+            self.base_path / "build" / "bin" / self.platform_config["binary_name"]
+        )
+        self._model_str = None
 
-        self.num_threads = num_threads if num_threads is not None else self.DEFAULT_THREADS
+        self.num_threads = (
+            num_threads if num_threads is not None else self._auto_threads()
+        )
         
         if self.num_threads < 1:
             raise WhisperCPPError("Number of threads must be at least 1")
 
         self.verbose = verbose
-        
+        self.flash_attn = flash_attn
+        self.env = None
+        if gpu_device is not None:
+            self.env = dict(os.environ, CUDA_VISIBLE_DEVICES=str(gpu_device))
+        self.persistent = persistent
+        self._server = None
+        self._server_port = None
+        self._server_log = None
+
         if not skip_checks:
             self._check_requirements()
             self.setup()
+            if self.persistent:
+                self.start_server()
+
+    def _physical_cores(self) -> int:
+        """Count usable physical cores, ignoring SMT siblings"""
+        if self.system == "darwin":
+            try:
+                return int(
+                    subprocess.check_output(["sysctl", "-n", "hw.physicalcpu"]).strip()
+                )
+            except (subprocess.SubprocessError, OSError, ValueError):
+                return self.DEFAULT_THREADS
+
+        return len(self._core_topology()) or 1
+
+    def _core_topology(self) -> Dict[Tuple[str, str], Set[int]]:
+        """Map each usable (physical id, core id) to its logical CPUs on Linux.
+
+        Falls back to one core per logical CPU when /proc/cpuinfo has no core
+        ids, as on many ARM kernels.
+        """
+        try:
+            allowed = os.sched_getaffinity(0)
+        except (AttributeError, OSError):
+            allowed = set(range(self.DEFAULT_THREADS))
+
+        cores = {}
+        try:
+            with open("/proc/cpuinfo") as f:
+                processor = physical_id = None
+                for line in f:
+                    key, _, value = line.partition(":")
+                    key, value = key.strip(), value.strip()
+                    if key == "processor":
+                        processor = int(value)
+                    elif key == "physical id":
+                        physical_id = value
+                    elif key == "core id" and processor in allowed:
+                        cores.setdefault((physical_id, value), set()).add(processor)
+        except (OSError, ValueError):
+            cores = {}
+
+        if not cores:
+            cores = {("", str(cpu)): {cpu} for cpu in allowed}
+        return cores
+
+    def _auto_threads(self) -> int:
+        """Default thread count: physical cores, capped by model size"""
+        cap = 8
+        if not self.custom_model:
+            family = self.model_name.split(".")[0].split("-")[0]
+            cap = self.MODEL_THREAD_CAPS.get(family, cap)
+        return max(1, min(self._physical_cores(), cap))
 
     def _setup_platform_configs(self) -> None:
         self.platform_configs = {
             "linux": {
                 "binary_name": "whisper-cli",
+                "server_binary_name": "whisper-server",
+                "quantize_binary_name": "quantize",
                 "cmake_args": ["-DCMAKE_BUILD_TYPE=Release"],
             },
             "darwin": {
                 "binary_name": "whisper-cli",
+                "server_binary_name": "whisper-server",
+                "quantize_binary_name": "quantize",
                 "cmake_args": ["-DCMAKE_BUILD_TYPE=Release"],
             },
         }
@@ -88,13 +388,83 @@ class WhisperCPP:
             raise WhisperCPPError(f"Unsupported platform: {self.system}")
 
         self.platform_config = self.platform_configs[self.system]
+        if self.build_flags is not None:
+            self.platform_config["cmake_args"].extend(self.build_flags)
+        else:
+            self.platform_config["cmake_args"].extend(self._detect_cpu_flags())
+
+        if self.device == "auto":
+            self.device = self._detect_device()
+        self.platform_config["cmake_args"].extend(self.DEVICE_CMAKE_ARGS[self.device])
+
+    def _detect_cpu_flags(self) -> List[str]:
+        """Pick host-specific cmake flags on top of ggml's native CPU tuning"""
+        flags = []
+
+        # GGML_NATIVE (on by default) already compiles with -march=native, so
+        # x86 SIMD and arm64 NEON are picked up without explicit flags
+        if self.system == "darwin":
+            flags.extend(["-DGGML_BLAS=ON", "-DGGML_BLAS_VENDOR=Apple"])
+
+        return flags
+
+    def _detect_device(self) -> str:
+        """Pick the best available backend, reusing the result of a previous probe"""
+        probe_file = self.base_path / "build" / ".build_flags"
+        try:
+            device = json.loads(probe_file.read_text())["device"]
+            if device in self.DEVICE_CMAKE_ARGS:
+                return device
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+        device = "cpu"
+        if self.system == "darwin" and platform.machine().lower() == "arm64":
+            device = "metal"
+        elif shutil.which("nvcc"):
+            # The CUDA build needs nvcc; nvidia-smi, when present, confirms a GPU
+            device = "cuda"
+            if shutil.which("nvidia-smi"):
+                try:
+                    subprocess.run(
+                        ["nvidia-smi", "-L"],
+                        check=True,
+                        capture_output=True,
+                        timeout=0.5,
+                    )
+                except (subprocess.SubprocessError, OSError):
+                    device = "cpu"
+
+        self.logger.debug(f"Detected device: {device}")
+        return device
+
+    def _build_signature(self) -> str:
+        """Fingerprint of the whisper.cpp version and cmake arguments"""
+        return hashlib.sha256(
+            "||".join(
+                [self.WHISPER_CPP_VERSION] + sorted(self.platform_config["cmake_args"])
+            ).encode()
+        ).hexdigest()
 
     def _is_binary_ready(self) -> bool:
-        """Check if the whisper binary is ready"""
-        binary_path = (
-            self.base_path / "build" / "bin" / self.platform_config["binary_name"]
-        )
-        return binary_path.exists() and binary_path.is_file()
+        """Check if the whisper binary is ready and built with the current flags"""
+        build_path = self.base_path / "build"
+        binary_path = build_path / "bin" / self.platform_config["binary_name"]
+        if not (binary_path.exists() and binary_path.is_file()):
+            return False
+        if self.persistent:
+            server_name = self.platform_config["server_binary_name"]
+            if not (build_path / "bin" / server_name).is_file():
+                return False
+        if self.quantization != "fp16":
+            quantize_name = self.platform_config["quantize_binary_name"]
+            if not (build_path / "bin" / quantize_name).is_file():
+                return False
+        try:
+            signature = (build_path / ".build_signature").read_text().strip()
+        except OSError:
+            return False
+        return signature == self._build_signature()
 
     def _is_repo_valid(self) -> bool:
         """Check if the repository is valid"""
@@ -105,21 +475,30 @@ class WhisperCPP:
     def _is_model_valid(self) -> bool:
         """Check if the model file is valid"""
         if self.model_path is None:
-            self.model_path = self.base_path / "models" / f"ggml-{self.model_name}.bin"
+            self.source_model_path = (
+                self.base_path / "models" / f"ggml-{self.model_name}.bin"
+            )
+            self.model_path = self.source_model_path
+            if self.quantization != "fp16":
+                self.model_path = self._quantized_path(self.source_model_path)
         return self.model_path.exists() and self.model_path.stat().st_size > 0
 
     def check_ready(self) -> bool:
         """Check if everything is ready for transcription"""
-        if not all(
-            [self.state.is_repo_ready, self.state.is_built, self.state.is_model_ready]
-        ):
-            self.state.is_repo_ready = self._is_repo_valid()
-            self.state.is_built = self._is_binary_ready()
-            self.state.is_model_ready = self._is_model_valid()
+        state = self.state
+        if state.is_repo_ready and state.is_built and state.is_model_ready:
+            # Trust the cached state; call invalidate() to force a re-check
+            return True
 
-        return all(
-            [self.state.is_repo_ready, self.state.is_built, self.state.is_model_ready]
-        )
+        state.is_repo_ready = self._is_repo_valid()
+        state.is_built = self._is_binary_ready()
+        state.is_model_ready = self._is_model_valid()
+        self._model_str = str(self.model_path)
+        return state.is_repo_ready and state.is_built and state.is_model_ready
+
+    def invalidate(self) -> None:
+        """Forget cached readiness so the next check_ready() re-checks the disk"""
+        self.state = WhisperState()
 
     def _check_requirements(self) -> None:
         """Check if all required system commands are available"""
@@ -140,14 +519,17 @@ class WhisperCPP:
         try:
             self.base_path.mkdir(parents=True, exist_ok=True)
             self.cache_dir.mkdir(parents=True, exist_ok=True)
+            _sweep_tmp_files(self.cache_dir)
+            _sweep_tmp_files(self.cache_dir / "index")
 
             if not self.check_ready():
                 if not self.state.is_repo_ready:
                     self._setup_repository()
-                if not self.state.is_model_ready:
-                    self._setup_model()
+                # Build before the model, which may need the quantize tool
                 if not self.state.is_built:
                     self._build_library()
+                if not self.state.is_model_ready:
+                    self._setup_model()
 
                 # Final verification
                 if not self.check_ready():
@@ -155,6 +537,12 @@ class WhisperCPP:
             else:
                 self.logger.info("System already set up and ready")
 
+            if self.model_cache_size is not None:
+                self._evict_models()
+            if self.keep_hot:
+                self._keep_model_hot()
+            self._model_str = str(self.model_path)
+
         except subprocess.CalledProcessError as e:
             raise WhisperCPPError(
                 f"Setup failed: {e.stderr.decode() if e.stderr else str(e)}"
@@ -178,7 +566,7 @@ class WhisperCPP:
                 [
                     "git",
                     "checkout",
-                    "v1.7.6",
+                    self.WHISPER_CPP_VERSION,
                 ],
                 cwd=self.base_path,
                 check=True,
@@ -195,21 +583,286 @@ class WhisperCPP:
 
     def _setup_model(self) -> None:
         if not self._is_model_valid():
-            self.logger.info(f"Setting up model: {self.model_name}")
-            model_script = self.base_path / "models" / "download-ggml-model.sh"
+            source = self.source_model_path
+            if not (source.exists() and source.stat().st_size > 0):
+                if self.custom_model:
+                    raise WhisperCPPError(f"Model file not found: {source}")
+                self.logger.info(f"Setting up model: {self.model_name}")
+                base_url = (
+                    self.TDRZ_MODEL_URL if "tdrz" in self.model_name else self.MODEL_URL
+                )
+                self._download_model(f"{base_url}/ggml-{self.model_name}.bin", source)
+            if self.quantization != "fp16":
+                self._quantize_model()
+        self.state.is_model_ready = True
+
+    def _quantized_path(self, model_path: Path) -> Path:
+        return model_path.with_name(f"{model_path.stem}-{self.quantization}.bin")
+
+    def _quantize_model(self) -> None:
+        """Write a quantized copy of the source model to model_path"""
+        self.logger.info(f"Quantizing model to {self.quantization}...")
+        bin_path = self.base_path / "build" / "bin"
+        quantize = bin_path / self.platform_config["quantize_binary_name"]
+        tmp_path = _tmp_path(self.model_path)
+        try:
             subprocess.run(
-                ["bash", str(model_script), self.model_name],
-                cwd=self.base_path,
+                [
+                    str(quantize),
+                    str(self.source_model_path),
+                    str(tmp_path),
+                    self.quantization,
+                ],
                 check=True,
                 capture_output=True,
             )
-        self.state.is_model_ready = True
+            os.replace(tmp_path, self.model_path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    def _probe_download(self, url: str) -> Dict[str, Optional[str]]:
+        """Resolve redirects and read size, range support and sha256 for url"""
+        import urllib.error
+        import urllib.request
+
+        class _NoRedirect(urllib.request.HTTPRedirectHandler):
+            def redirect_request(self, *args, **kwargs):
+                return None
+
+        # Hugging Face only exposes the LFS sha256 on the redirect response
+        opener = urllib.request.build_opener(_NoRedirect)
+        sha256 = None
+        try:
+            with opener.open(urllib.request.Request(url, method="HEAD"), timeout=30):
+                pass
+        except urllib.error.HTTPError as e:
+            if e.code not in (301, 302, 303, 307, 308):
+                raise WhisperCPPError(f"Model download failed: {url} ({e.code})")
+            etag = e.headers.get("X-Linked-Etag")
+            sha256 = etag.strip('"') if etag else None
+            url = urllib.request.urljoin(url, e.headers["Location"])
+
+        with urllib.request.urlopen(
+            urllib.request.Request(url, method="HEAD"), timeout=30
+        ) as resp:
+            return {
+                "url": resp.geturl(),
+                "size": resp.headers.get("Content-Length"),
+                "ranges": resp.headers.get("Accept-Ranges"),
+                "sha256": sha256,
+            }
+
+    def _download_model(self, url: str, dst: Path) -> None:
+        """Download url to dst in parallel byte ranges, resuming partial downloads"""
+        import concurrent.futures
+        import http.client
+        import urllib.error
+        import urllib.request
+
+        part_path = dst.with_name(f"{dst.name}.part")
+        progress_path = dst.with_name(f"{dst.name}.part.json")
+
+        try:
+            info = self._probe_download(url)
+        except (urllib.error.URLError, http.client.HTTPException, OSError) as e:
+            raise WhisperCPPError(f"Model download failed: {e}")
+
+        if info["size"] is None or info["ranges"] != "bytes":
+            self._download_serial(info["url"], part_path)
+        else:
+            size = int(info["size"])
+            try:
+                progress = json.loads(progress_path.read_text())
+            except (OSError, ValueError):
+                progress = {}
+            if progress.get("size") != size or not part_path.exists():
+                progress = {"size": size, "done": []}
+
+            ranges = [
+                (start, min(start + self.DOWNLOAD_CHUNK_SIZE, size) - 1)
+                for start in range(0, size, self.DOWNLOAD_CHUNK_SIZE)
+            ]
+            done = set(progress["done"])
+            todo = [r for r in ranges if r[0] not in done]
+            if done:
+                self.logger.info(
+                    f"Resuming download: {len(ranges) - len(todo)}/{len(ranges)} chunks"
+                )
+
+            fd = os.open(part_path, os.O_RDWR | os.O_CREAT)
+            lock = threading.Lock()
+            try:
+                if not done:
+                    if hasattr(os, "posix_fallocate"):
+                        os.posix_fallocate(fd, 0, size)
+                    else:
+                        os.ftruncate(fd, size)
+
+                def fetch(start: int, end: int) -> None:
+                    request = urllib.request.Request(
+                        info["url"], headers={"Range": f"bytes={start}-{end}"}
+                    )
+                    offset = start
+                    with urllib.request.urlopen(request, timeout=60) as resp:
+                        if resp.status != 206:
+                            raise WhisperCPPError("Server ignored range request")
+                        while True:
+                            data = resp.read(1 << 20)
+                            if not data:
+                                break
+                            os.pwrite(fd, data, offset)
+                            offset += len(data)
+                    if offset != end + 1:
+                        raise WhisperCPPError("Model download truncated")
+                    with lock:
+                        done.add(start)
+                        progress["done"] = sorted(done)
+                        progress_path.write_text(json.dumps(progress))
+
+                with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.DOWNLOAD_WORKERS
+                ) as pool:
+                    futures = [pool.submit(fetch, *r) for r in todo]
+                    for future in concurrent.futures.as_completed(futures):
+                        future.result()
+                os.fsync(fd)
+            except (urllib.error.URLError, http.client.HTTPException, OSError) as e:
+                raise WhisperCPPError(f"Model download failed: {e}")
+            finally:
+                os.close(fd)
+
+        if info["sha256"]:
+            h = hashlib.sha256()
+            mv = memoryview(bytearray(HASH_CHUNK_SIZE))
+            with open(part_path, "rb") as f:
+                while True:
+                    n = f.readinto(mv)
+                    if not n:
+                        break
+                    h.update(mv[:n])
+            if h.hexdigest() != info["sha256"]:
+                part_path.unlink()
+                progress_path.unlink(missing_ok=True)
+                raise WhisperCPPError("Model download failed: checksum mismatch")
+
+        os.replace(part_path, dst)
+        progress_path.unlink(missing_ok=True)
+
+    def _download_serial(self, url: str, part_path: Path) -> None:
+        """Single-connection download, appending to any existing partial file"""
+        import http.client
+        import urllib.error
+        import urllib.request
+
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        try:
+            with urllib.request.urlopen(
+                urllib.request.Request(url, headers=headers), timeout=60
+            ) as resp:
+                mode = "ab" if resp.status == 206 else "wb"
+                with open(part_path, mode) as f:
+                    shutil.copyfileobj(resp, f, 1 << 20)
+        except urllib.error.HTTPError as e:
+            if e.code != 416:  # Requested range past the end: already complete
+                raise WhisperCPPError(f"Model download failed: {e}")
+        except (urllib.error.URLError, http.client.HTTPException, OSError) as e:
+            raise WhisperCPPError(f"Model download failed: {e}")
+
+    def _evict_models(self) -> None:
+        """Remove least recently used models until the models dir fits the budget"""
+        current = self.disk_model_path or self.model_path
+        # Use is recorded in atime; mtime is left alone since keep_hot compares it
+        os.utime(current, ns=(time.time_ns(), current.stat().st_mtime_ns))
+        models = sorted(
+            (self.base_path / "models").glob("ggml-*.bin"),
+            key=lambda p: p.stat().st_atime,
+        )
+        total = sum(p.stat().st_size for p in models)
+        for model in models:
+            if total <= self.model_cache_size:
+                break
+            if model == current:
+                continue
+            self.logger.info(f"Evicting cached model: {model.name}")
+            total -= model.stat().st_size
+            model.unlink()
+
+    def _keep_model_hot(self) -> None:
+        """Serve the model from tmpfs so it cannot be evicted from the page cache"""
+        if self.model_path.parent == self.HOT_MODEL_DIR:
+            return
+        if not self.HOT_MODEL_DIR.parent.is_dir():
+            self.logger.debug("No /dev/shm on this platform, keep_hot ignored")
+            return
+
+        if not self._prepare_hot_dir():
+            return
+        _sweep_tmp_files(self.HOT_MODEL_DIR)
+
+        hot_path = self.HOT_MODEL_DIR / self.model_path.name
+        st = self.model_path.stat()
+        try:
+            hot_st = hot_path.stat()
+            fresh = (hot_st.st_uid, hot_st.st_size, hot_st.st_mtime_ns) == (
+                os.getuid(),
+                st.st_size,
+                st.st_mtime_ns,
+            )
+        except OSError:
+            fresh = False
+
+        if not fresh:
+            self.logger.info(f"Copying model to {hot_path}")
+            tmp_path = _tmp_path(hot_path)
+            try:
+                _fast_copy(self.model_path, tmp_path)
+                # Mirror the source mtime so later runs can tell the copy is current
+                os.utime(tmp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+                os.replace(tmp_path, hot_path)
+            except OSError as e:
+                tmp_path.unlink(missing_ok=True)
+                self.logger.warning(f"Could not copy model to tmpfs: {e}")
+                return
+
+        self.disk_model_path = self.model_path
+        self.model_path = hot_path
+
+    def _prepare_hot_dir(self) -> bool:
+        """Create the per-user tmpfs dir and check nobody else can write to it"""
+        try:
+            self.HOT_MODEL_DIR.mkdir(mode=0o700, exist_ok=True)
+            st = os.lstat(self.HOT_MODEL_DIR)
+        except OSError as e:
+            self.logger.warning(f"Could not create {self.HOT_MODEL_DIR}: {e}")
+            return False
+
+        # Anything inside is trusted by size/mtime, so the dir must be ours alone
+        if (
+            not stat.S_ISDIR(st.st_mode)
+            or st.st_uid != os.getuid()
+            or st.st_mode & 0o077
+        ):
+            self.logger.warning(
+                f"{self.HOT_MODEL_DIR} is not a private directory, keep_hot ignored"
+            )
+            return False
+        return True
 
     def _build_library(self) -> None:
         if not self._is_binary_ready():
             self.logger.info("Building whisper.cpp...")
             build_path = self.base_path / "build"
-            build_path.mkdir(exist_ok=True)
+            if build_path.exists():
+                # Stale configuration from a different version or set of flags
+                shutil.rmtree(build_path)
+            build_path.mkdir()
+            if self._auto_device:
+                # Written here rather than at probe time, since the repository
+                # may not have been cloned into base_path yet
+                (build_path / ".build_flags").write_text(
+                    json.dumps({"device": self.device})
+                )
 
             subprocess.run(
                 ["cmake", "-B", str(build_path)] + self.platform_config["cmake_args"],
@@ -231,6 +884,7 @@ class WhisperCPP:
                 check=True,
                 capture_output=True,
             )
+            (build_path / ".build_signature").write_text(self._build_signature())
         self.state.is_built = True
 
     def transcribe(
@@ -240,63 +894,521 @@ class WhisperCPP:
         language: Optional[str] = None,
         translate: bool = False,
         prompt: Optional[str] = None,
+        cache: bool = True,
     ) -> str:
         """Transcribe audio file"""
+        text = "".join(
+            self.transcribe_stream(
+                audio_path, convert, language, translate, prompt, cache
+            )
+        )
+        return text.strip()
+
+    def transcribe_stream(
+        self,
+        audio_path: Union[str, Path],
+        convert: bool = True,
+        language: Optional[str] = None,
+        translate: bool = False,
+        prompt: Optional[str] = None,
+        cache: bool = True,
+    ) -> Iterator[str]:
+        """Transcribe audio file, yielding output lines as whisper.cpp emits them.
+
+        With cache=False the converted audio is piped straight from ffmpeg to
+        whisper.cpp and never written to the cache directory.
+        """
         if not self.check_ready():
             raise WhisperCPPError("System not ready. Run setup() first")
 
+        if convert and not cache:
+            yield from self._infer_piped(audio_path, language, translate, prompt)
+            return
+
         if convert:
             audio_path = self.convert_audio(audio_path)
 
+        yield from self._infer(audio_path, language, translate, prompt)
+
+    def transcribe_many(
+        self,
+        audio_paths: Iterable[Union[str, Path]],
+        language: Optional[str] = None,
+        translate: bool = False,
+        prompt: Optional[str] = None,
+    ) -> Dict[str, str]:
+        """Transcribe many audio files, converting the next file during inference.
+
+        A background thread converts audio into a small bounded queue while the
+        calling thread runs whisper.cpp, so ffmpeg time is hidden behind inference.
+        On Linux, when a physical core is left over beyond num_threads, whisper-cli
+        and ffmpeg are pinned to disjoint cores so the two stages do not compete
+        for the same CPUs and caches.
+        Returns a mapping of input path to transcript.
+        """
+        if not self.check_ready():
+            raise WhisperCPPError("System not ready. Run setup() first")
+
+        paths = [str(p) for p in audio_paths]
+        pending = queue.Queue(maxsize=2)
+        stop = threading.Event()
+        # A persistent server serves all requests, so nothing is pinned then
+        ffmpeg_cores, whisper_cores = (
+            (None, None) if self.persistent else self._split_cores()
+        )
+
+        def producer() -> None:
+            try:
+                if ffmpeg_cores:
+                    # Affinity is per thread on Linux; ffmpeg children inherit it
+                    os.sched_setaffinity(0, ffmpeg_cores)
+                for path in paths:
+                    if stop.is_set():
+                        return
+                    pending.put((path, self._convert_audio(path, threads=1)))
+            except Exception as e:
+                pending.put(e)
+                return
+            pending.put(None)
+
+        thread = threading.Thread(target=producer, daemon=True)
+        thread.start()
+
+        results = {}
+        try:
+            while True:
+                item = pending.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                path, wav_path = item
+                text = "".join(
+                    self._infer(wav_path, language, translate, prompt, whisper_cores)
+                )
+                results[path] = text.strip()
+        finally:
+            stop.set()
+            # Drain so a producer blocked on put() can observe stop and exit
+            while thread.is_alive():
+                try:
+                    pending.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            thread.join()
+
+        return results
+
+    def _split_cores(self) -> Tuple[Optional[Set[int]], Optional[Set[int]]]:
+        """Partition usable CPUs into (ffmpeg, whisper.cpp) sets.
+
+        The split is by physical core, so SMT siblings always land on the same
+        side: whisper.cpp gets num_threads physical cores, ffmpeg the rest.
+        Returns (None, None) where affinity is unsupported or no physical core
+        is left over for ffmpeg.
+        """
+        if not hasattr(os, "sched_setaffinity"):
+            return None, None
+        cores = sorted(self._core_topology().values(), key=min)
+        split = len(cores) - self.num_threads
+        if split < 1:
+            return None, None
+        return set().union(*cores[:split]), set().union(*cores[split:])
+
+    def _infer(
+        self,
+        audio_path: Union[str, Path],
+        language: Optional[str] = None,
+        translate: bool = False,
+        prompt: Optional[str] = None,
+        affinity: Optional[Set[int]] = None,
+    ) -> Iterator[str]:
+        """Run inference on a converted wav with the server or whisper-cli"""
+        if self.persistent:
+            yield self._server_inference(audio_path, language, translate, prompt)
+        else:
+            cmd = self._build_command(audio_path, language, translate, prompt)
+            yield from self._stream_command(cmd, affinity=affinity)
+
+    def _infer_piped(
+        self,
+        audio_path: Union[str, Path],
+        language: Optional[str] = None,
+        translate: bool = False,
+        prompt: Optional[str] = None,
+    ) -> Iterator[str]:
+        """Convert with ffmpeg and feed the wav to whisper.cpp without a cache file"""
+        ffmpeg_cmd = _ffmpeg_cmd(str(audio_path), "-", self.SAMPLE_RATE)
+
+        if self.persistent:
+            try:
+                result = subprocess.run(ffmpeg_cmd, check=True, capture_output=True)
+            except subprocess.CalledProcessError as e:
+                raise WhisperCPPError(f"Audio conversion failed: {e.stderr.decode()}")
+            yield self._server_inference(result.stdout, language, translate, prompt)
+            return
+
+        cmd = self._build_command("-", language, translate, prompt)
+        with tempfile.TemporaryFile() as ffmpeg_stderr:
+            ffmpeg = subprocess.Popen(
+                ffmpeg_cmd,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=ffmpeg_stderr,
+            )
+
+            def ffmpeg_stderr_text() -> str:
+                ffmpeg_stderr.seek(0)
+                return ffmpeg_stderr.read().decode(errors="replace")
+
+            def conversion_error() -> WhisperCPPError:
+                return WhisperCPPError(
+                    f"Audio conversion failed: {ffmpeg_stderr_text()}"
+                )
+
+            def ffmpeg_failed_on_its_own() -> bool:
+                # ffmpeg dies on SIGPIPE, or exits with EPIPE, when whisper-cli
+                # stops reading early; that is a consequence, not the cause
+                if ffmpeg.returncode in (0, -signal.SIGPIPE):
+                    return False
+                return "Broken pipe" not in ffmpeg_stderr_text()
+
+            try:
+                yield from self._stream_command(cmd, stdin=ffmpeg.stdout)
+            except WhisperCPPError as e:
+                ffmpeg.wait()
+                # A whisper.cpp failure caused by bad input is reported as such
+                if ffmpeg_failed_on_its_own():
+                    raise conversion_error() from e
+                raise
+            except BaseException:
+                # Caller stopped iterating or was interrupted
+                ffmpeg.kill()
+                ffmpeg.wait()
+                raise
+
+            if ffmpeg.wait() != 0:
+                raise conversion_error()
+
+    def _gpu_args(self) -> List[str]:
+        """whisper.cpp flags for the GPU backend the library was built with"""
+        # Flash attention is only enabled where the backend reliably supports it
+        if self.device == "cuda" and self.flash_attn:
+            return ["--flash-attn"]
+        return []
+
+    def _build_command(
+        self,
+        audio_path: Union[str, Path],
+        language: Optional[str] = None,
+        translate: bool = False,
+        prompt: Optional[str] = None,
+    ) -> List[str]:
+        """Build the whisper-cli command line for a single audio file"""
         cmd = [
-            str(self.base_path / "build" / "bin" / self.platform_config["binary_name"]),
+            self._binary_str,
             "-m",
-            str(self.model_path),
+            self._model_str,
             "-f",
             str(audio_path),
             "-nt",
             "-t",
             str(self.num_threads),
         ]
-        
+
         if self.verbose:
             cmd.append("-debug")
-            
+
+        cmd.extend(self._gpu_args())
+
         if language:
             cmd.extend(["-l", language])
         if translate:
             cmd.append("--translate")
         if prompt:
             cmd.extend(["--prompt", prompt])
+        return cmd
+
+    def _stream_command(
+        self,
+        cmd: List[str],
+        stdin: Optional[IO[bytes]] = None,
+        affinity: Optional[Set[int]] = None,
+    ) -> Iterator[str]:
+        """Run whisper-cli, yielding stdout lines as they arrive.
+
+        When stdin is a pipe from another process it is closed in this process
+        once whisper-cli holds it, so the writer sees SIGPIPE if whisper-cli exits.
+        affinity pins whisper-cli to the given CPUs right after it starts.
+        """
+        if self.verbose:
+            try:
+                process = subprocess.Popen(cmd, stdin=stdin, env=self.env)
+            finally:
+                if stdin is not None:
+                    stdin.close()
+            _pin(process, affinity)
+            try:
+                returncode = process.wait()
+            finally:
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+            if returncode != 0:
+                raise WhisperCPPError(
+                    f"Transcription failed with exit code {returncode}"
+                )
+            yield "Output printed to console"
+            return
+
+        # stderr goes to a file so a chatty whisper-cli cannot fill the pipe
+        # and stall while we are blocked reading stdout
+        with tempfile.TemporaryFile() as stderr:
+            try:
+                process = subprocess.Popen(
+                    cmd,
+                    stdin=stdin,
+                    env=self.env,
+                    stdout=subprocess.PIPE,
+                    stderr=stderr,
+                    text=True,
+                    bufsize=1,
+                )
+            finally:
+                if stdin is not None:
+                    stdin.close()
+            _pin(process, affinity)
+            try:
+                for line in process.stdout:
+                    yield line
+                process.stdout.close()
+                returncode = process.wait()
+            finally:
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+
+            if returncode != 0:
+                stderr.seek(0)
+                raise WhisperCPPError(
+                    f"Transcription failed: {stderr.read().decode(errors='replace')}"
+                )
+
+    def start_server(self, timeout: float = 60.0) -> None:
+        """Launch whisper-server so the model stays loaded between calls"""
+        if self._server is not None and self._server.poll() is None:
+            return
+        if not self.check_ready():
+            raise WhisperCPPError("System not ready. Run setup() first")
+
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+
+        cmd = [
+            str(
+                self.base_path
+                / "build"
+                / "bin"
+                / self.platform_config["server_binary_name"]
+            ),
+            "-m",
+            self._model_str,
+            "-t",
+            str(self.num_threads),
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(port),
+        ]
+        cmd.extend(self._gpu_args())
+
+        self.logger.info("Starting whisper-server...")
+        self._server_log = None if self.verbose else tempfile.TemporaryFile()
+        self._server = subprocess.Popen(
+            cmd,
+            stdin=subprocess.DEVNULL,
+            env=self.env,
+            stdout=self._server_log,
+            stderr=self._server_log,
+        )
+        self._server_port = port
+
+        deadline = time.monotonic() + timeout
+        while True:
+            if self._server.poll() is not None:
+                log = ""
+                if self._server_log is not None:
+                    self._server_log.seek(0)
+                    log = self._server_log.read().decode(errors="replace")
+                self.stop_server()
+                raise WhisperCPPError(f"whisper-server exited during startup: {log}")
+            try:
+                with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                    break
+            except OSError:
+                if time.monotonic() > deadline:
+                    self.stop_server()
+                    raise WhisperCPPError("Timed out waiting for whisper-server")
+                time.sleep(0.1)
+
+    def stop_server(self) -> None:
+        """Terminate the persistent whisper-server, if running"""
+        server, self._server = self._server, None
+        if server is not None and server.poll() is None:
+            server.terminate()
+            try:
+                server.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                server.kill()
+                server.wait()
+        if self._server_log is not None:
+            self._server_log.close()
+            self._server_log = None
+
+    def _server_inference(
+        self,
+        audio: Union[str, Path, bytes],
+        language: Optional[str] = None,
+        translate: bool = False,
+        prompt: Optional[str] = None,
+    ) -> str:
+        """POST a wav file, or in-memory wav bytes, to whisper-server"""
+        import http.client
+        import uuid
+
+        if self._server is None or self._server.poll() is not None:
+            self.start_server()
+
+        fields = {"response_format": "text", "translate": str(translate).lower()}
+        if language:
+            fields["language"] = language
+        if prompt:
+            fields["prompt"] = prompt
 
+        boundary = uuid.uuid4().hex
+        parts = []
+        for name, value in fields.items():
+            parts.append(
+                f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"'
+                f"\r\n\r\n{value}\r\n".encode()
+            )
+        filename = "audio.wav" if isinstance(audio, bytes) else Path(audio).name
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="file"; '
+            f'filename="{filename}"\r\n'
+            "Content-Type: audio/wav\r\n\r\n".encode()
+        )
+        if isinstance(audio, bytes):
+            parts.append(audio)
+        else:
+            with open(audio, "rb") as f:
+                parts.append(f.read())
+        parts.append(f"\r\n--{boundary}--\r\n".encode())
+        body = b"".join(parts)
+
+        conn = http.client.HTTPConnection("127.0.0.1", self._server_port)
         try:
-            result = subprocess.run(
-                cmd, 
-                capture_output=not self.verbose,
-                text=True, 
-                check=True
+            conn.request(
+                "POST",
+                "/inference",
+                body=body,
+                headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
             )
-            return result.stdout.strip() if not self.verbose else "Output printed to console"
-        except subprocess.CalledProcessError as e:
-            raise WhisperCPPError(f"Transcription failed: {e.stderr}")
+            resp = conn.getresponse()
+            text = resp.read().decode(errors="replace")
+        except (http.client.HTTPException, OSError) as e:
+            raise WhisperCPPError(f"Transcription failed: {e}")
+        finally:
+            conn.close()
+
+        if resp.status != 200:
+            raise WhisperCPPError(f"Transcription failed: {text}")
+        return text
+
+    def close(self) -> None:
+        """Release background resources"""
+        self.stop_server()
+
+    def __enter__(self) -> "WhisperCPP":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
 
     def convert_audio(self, audio_path: Union[str, Path]) -> str:
         """Convert audio with caching"""
-        input_path = Path(audio_path)
-        cache_key = hashlib.md5(str(input_path.absolute()).encode()).hexdigest()
-        cache_path = self.cache_dir / f"{cache_key}.wav"
-
-        if cache_path.exists():
-            self.logger.debug("Using cached converted audio")
-            return str(cache_path)
+        return self._convert_audio(audio_path)
 
+    def _convert_audio(
+        self, audio_path: Union[str, Path], threads: Optional[int] = None
+    ) -> str:
+        input_path = Path(audio_path).resolve()
         try:
-            self.logger.debug("Converting audio...")
-            stream = ffmpeg.input(str(input_path))
-            stream = ffmpeg.output(
-                stream, str(cache_path), ar=self.SAMPLE_RATE, ac=1, acodec="pcm_s16le"
-            )
-            ffmpeg.run(stream, capture_stdout=True, capture_stderr=True)
-            return str(cache_path)
-        except ffmpeg.Error as e:
-            raise WhisperCPPError(f"Audio conversion failed: {e.stderr.decode()}")
\ No newline at end of file
+            st = input_path.stat()
+        except OSError as e:
+            raise WhisperCPPError(f"Cannot read audio file: {e}")
+        args = (
+            str(input_path),
+            self.SAMPLE_RATE,
+            str(self.cache_dir),
+            st.st_size,
+            st.st_mtime_ns,
+            threads,
+        )
+        wav_path = _resolve_or_convert(*args)
+        if not os.path.exists(wav_path):
+            # Purged from the cache dir since it was memoized; converting again
+            # recreates the same content-addressed path, so the memo stays valid
+            wav_path = _resolve_or_convert.__wrapped__(*args)
+        return wav_path
+
+    def convert_audio_batch(
+        self,
+        audio_paths: Iterable[Union[str, Path]],
+        max_workers: Optional[int] = None,
+    ) -> Dict[str, str]:
+        """Convert many audio files, running cache misses in parallel.
+
+        Each ffmpeg job is limited to a single thread so the pool, not ffmpeg,
+        provides the parallelism. Returns a mapping of input path to wav path.
+        """
+        import concurrent.futures
+
+        results = {}
+        misses = {}
+        for audio_path in audio_paths:
+            input_path = Path(audio_path).resolve()
+            try:
+                cache_key = _content_hash(input_path, self.cache_dir)
+            except OSError as e:
+                raise WhisperCPPError(f"Cannot read audio file: {e}")
+            cache_path = str(self.cache_dir / f"{cache_key}.wav")
+            results[str(audio_path)] = cache_path
+            if not os.path.exists(cache_path):
+                # Identical content shares a cache path; convert it only once
+                misses.setdefault(cache_path, str(input_path))
+
+        if misses:
+            self.logger.debug(f"Converting {len(misses)} audio files...")
+            workers = max_workers or min(len(misses), os.cpu_count() or 1)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [
+                    pool.submit(_convert, src, dst, self.SAMPLE_RATE, 1)
+                    for dst, src in misses.items()
+                ]
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+
+        return results
+
+    def clear_cache(self) -> None:
+        """Drop the in-process memo and index entries for purged cache files"""
+        _resolve_or_convert.cache_clear()
+        _prune_index(self.cache_dir)
@@ -0,0 +1,73 @@
+from pathlib import Path
+
+from whispercpp_kit import WhisperCPP, core
+
+
+def test_keep_model_hot_copies_model(tmp_path, monkeypatch):
+    model = tmp_path / "models" / "ggml-tiny.en.bin"
+    model.parent.mkdir()
+    model.write_bytes(b"ggml" * 1024)
+    hot_dir = tmp_path / "shm" / "whispercpp-kit"
+    hot_dir.parent.mkdir()
+    monkeypatch.setattr(WhisperCPP, "HOT_MODEL_DIR", hot_dir)
+
+    whisper = WhisperCPP(model_path=model, lib_dir=tmp_path, skip_checks=True)
+    whisper._keep_model_hot()
+
+    assert whisper.model_path == hot_dir / model.name
+    assert whisper.model_path.read_bytes() == model.read_bytes()
+    assert whisper.disk_model_path == model
+
+
+def test_keep_model_hot_rejects_shared_dir(tmp_path, monkeypatch):
+    model = tmp_path / "ggml-tiny.en.bin"
+    model.write_bytes(b"ggml")
+    hot_dir = tmp_path / "shm"
+    hot_dir.mkdir()
+    hot_dir.chmod(0o777)
+    monkeypatch.setattr(WhisperCPP, "HOT_MODEL_DIR", hot_dir)
+
+    whisper = WhisperCPP(model_path=model, lib_dir=tmp_path, skip_checks=True)
+    whisper._keep_model_hot()
+
+    assert whisper.model_path == model
+    assert not (hot_dir / model.name).exists()
+
+
+def test_convert_audio_recreates_purged_wav(tmp_path, monkeypatch):
+    conversions = []
+
+    def fake_convert(src, dst, sr, threads=None):
+        conversions.append(src)
+        Path(dst).write_bytes(b"RIFF")
+
+    monkeypatch.setattr(core, "_convert", fake_convert)
+    core._resolve_or_convert.cache_clear()
+    audio = tmp_path / "audio.mp3"
+    audio.write_bytes(b"mp3 data")
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+
+    whisper = WhisperCPP(cache_dir=cache_dir, lib_dir=tmp_path, skip_checks=True)
+    wav_path = whisper.convert_audio(audio)
+    Path(wav_path).unlink()
+
+    assert whisper.convert_audio(audio) == wav_path
+    assert Path(wav_path).exists()
+    assert len(conversions) == 2
+
+
+def test_clear_cache_prunes_orphaned_index_entries(tmp_path):
+    cache_dir = tmp_path / "cache"
+    (cache_dir / "index").mkdir(parents=True)
+    (cache_dir / "index" / "kept").write_text("4-1 abc")
+    (cache_dir / "abc.wav").write_bytes(b"RIFF")
+    (cache_dir / "index" / "orphan").write_text("4-1 def")
+    (cache_dir / "index.json").write_text("{}")
+
+    whisper = WhisperCPP(cache_dir=cache_dir, lib_dir=tmp_path, skip_checks=True)
+    whisper.clear_cache()
+
+    assert (cache_dir / "index" / "kept").exists()
+    assert not (cache_dir / "index" / "orphan").exists()
+    assert (cache_dir / "index.json").exists()